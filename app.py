@@ -1,25 +1,50 @@
 from fastapi import FastAPI, HTTPException, status, Query, Request
 
-from typing import List
-from pydantic import BaseModel, IPvAnyAddress
+from typing import Annotated, List
+from pydantic import BaseModel, Field, IPvAnyAddress, IPvAnyNetwork, field_validator
 from database import connect_db, disconnect_db, engine, metadata
 from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from fastapi.encoders import jsonable_encoder
 from asyncpg.exceptions import UniqueViolationError
 from typing import Optional
 
+import cache
 import crud
 import ipaddress
 import logging
+import orjson
+import models  # noqa: F401  Registers the table definitions on the metadata
 
 
 # Ensure tables are created in the database
 metadata.create_all(engine)
 
-app = FastAPI(title="ProphetSecurity", on_startup=[connect_db], on_shutdown=[disconnect_db])
+
+async def startup():
+    """Create the database connection pool, expose it on the application state
+    and load the in-process caches
+    """
+    app.state.pool = await connect_db()
+    await cache.load(app.state.pool)
+
+
+async def shutdown():
+    """Stop listening for cache updates and close the database connection pool"""
+    await cache.close()
+    await disconnect_db()
+
+
+# Responses are encoded with orjson, which is much faster than the standard json
+# module on the large lists returned by the event endpoints
+app = FastAPI(
+    title="ProphetSecurity",
+    default_response_class=ORJSONResponse,
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
 
 logger = logging.getLogger("FastAPI TestLogger")
 
@@ -48,6 +73,16 @@ class Event(BaseModel):
     application: str
     success: bool
 
+    @field_validator("source_ip")
+    @classmethod
+    def drop_scope_id(cls, ip):
+        """Drop the scope id of zone-scoped IPv6 addresses, e.g., fe80::1%eth0,
+        which neither the range matching nor the inet type accept
+        """
+        if getattr(ip, "scope_id", None):
+            return ipaddress.IPv6Address(int(ip))
+        return ip
+
 
 class EventResponse(BaseModel):
     """Model for event response, indicating if the event is suspicious"""
@@ -60,13 +95,21 @@ class EventResponse(BaseModel):
 class IPRange(BaseModel):
     """Model for IP range data in CIDR notation"""
 
-    cidr: str
+    cidr: IPvAnyNetwork
+
+
+class CidrQuery(BaseModel):
+    """Model for the CIDR range query parameter"""
+
+    cidr: IPvAnyNetwork = Field(
+        description="CIDR range to delete, e.g., 173.99.253.0/24"
+    )
 
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     """Handle request validation errors with a custom response format"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
         content=jsonable_encoder({"detail": exc.errors(), "body": exc.body}),
     )
@@ -76,15 +119,11 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 @app.post("/ip-ranges", response_model=dict, status_code=status.HTTP_201_CREATED, tags=["IPs"])
 async def add_ip_range(ip_range: IPRange):
     """Add a new IP range in CIDR notation.
-    Checks for correct format and uniqueness before adding to the database.
+    The format is validated by the IPRange model, uniqueness by the database.
     """
     try:
-        ipaddress.ip_network(ip_range.cidr)
-        await crud.add_ip_range(ip_range.cidr)
+        await crud.add_ip_range(str(ip_range.cidr))
         return {"message": "IP range added"}
-    except ValueError as e:
-        logger.error(f"Format nError occurred: {e}")
-        raise HTTPException(status_code=422, detail=str(e))
     except UniqueViolationError as e:
         logger.error(f"Unique constraint error occurred: {e}")
         raise HTTPException(status_code=422, detail="This IP range already exists.")
@@ -94,19 +133,18 @@ async def add_ip_range(ip_range: IPRange):
 async def get_ip_ranges():
     """Retrieve all IP ranges"""
     rows = await crud.get_ip_ranges()
-    return [IPRange(cidr=str(ipaddress.ip_network(row["cidr"]))) for row in rows]
+    # cidr values are decoded as their canonical text, see database._init_connection,
+    # so they are returned as is rather than parsed again by the response model
+    return ORJSONResponse([{"cidr": row["cidr"]} for row in rows])
 
 
 @app.delete("/ip-ranges", response_model=dict, tags=["IPs"])
-async def delete_ip_range(
-    cidr: str = Query(..., description="CIDR range to delete, e.g., 173.99.253.0/24")
-):
+async def delete_ip_range(query: Annotated[CidrQuery, Query()]):
     """Delete an IP range specified by CIDR notation.
     Raises an error if the IP range does not exist.
     """
     try:
-        ipaddress.ip_network(cidr)
-        await crud.delete_ip_range(cidr)
+        await crud.delete_ip_range(str(query.cidr))
         return {"message": "IP range deleted"}
     except Exception as e:
         # Handle cases where the CIDR might not exist
@@ -120,27 +158,59 @@ async def process_event_endpoint(events: List[Event]):
     """Process a list of events, marking them as suspicious if applicable.
     Returns a list event's username,ip with their suspicious status.
     """
-    results = []
-    for event in events:
-        is_suspicious = await crud.process_event(event.dict())
-        results.append(
-            EventResponse(
-                user=event.username, ip=event.source_ip, is_suspicious=is_suspicious
-            )
-        )
-    return results
+    # The whole batch is processed in a single transaction
+    flags = await crud.process_events_batch([event.model_dump() for event in events])
+    return [
+        EventResponse(user=event.username, ip=event.source_ip, is_suspicious=is_suspicious)
+        for event, is_suspicious in zip(events, flags)
+    ]
 
 
 # Get Suspicious Events
-@app.get("/suspicious-events", response_model=List[Event], tags=["Events"])
+@app.get(
+    "/suspicious-events",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "One suspicious event per line, most recent first",
+        }
+    },
+    tags=["Events"],
+)
 async def get_suspicious_events(
     limit: int = Query(100, ge=1, le=10000),
-    offset: int = Query(0, ge=0),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
+    before_ts: Optional[datetime] = Query(
+        None, description="timestamp of the last event received"
+    ),
+    before_id: Optional[int] = Query(None, description="id of the last event received"),
 ):
-    """Retrieve a paginated list of suspicious events with optional date filtering"""
-    events = await crud.get_suspicious_events(
-        start_date=start_date, end_date=end_date, limit=limit, offset=offset
+    """Stream suspicious events with optional date filtering as newline-delimited
+    JSON, one event per line.
+    Pass the timestamp and id of the last event received as before_ts and
+    before_id to get the following events.
+    The events must be read within 30 seconds. Past that, the response is cut
+    short: it ends without its terminating chunk, which HTTP clients report as an
+    incomplete read. Resume from the last complete line received.
+    """
+    if (before_ts is None) != (before_id is None):
+        raise HTTPException(
+            status_code=422, detail="before_ts and before_id must be given together"
+        )
+
+    events = crud.get_suspicious_events(
+        start_date=start_date,
+        end_date=end_date,
+        limit=limit,
+        before_ts=before_ts,
+        before_id=before_id,
     )
-    return events
+
+    async def encode_lines():
+        # source_ip is decoded as text, see database._init_connection
+        async for event in events:
+            yield orjson.dumps(event) + b"\n"
+
+    return StreamingResponse(encode_lines(), media_type="application/x-ndjson")
@@ -0,0 +1,170 @@
+from database import DATABASE_URL
+from ranges import RangeSet
+
+import asyncio
+import asyncpg
+import ipaddress
+import logging
+
+logger = logging.getLogger("FastAPI TestLogger")
+
+# In-process copies of the flagged_users and flagged_ips tables.
+# Flags are never removed, so the sets only ever grow.
+flagged_users = set()
+flagged_ips = set()
+
+# In-process copy of the suspicious_ip_ranges table, matched with vectorized
+# NumPy operations instead of a database round-trip
+suspicious_ranges = RangeSet()
+
+# Delay in seconds between attempts to reopen a lost listener connection
+RECONNECT_DELAY = 5
+
+# Pool the tables are read with, set on load
+_pool = None
+
+# Dedicated connection receiving the notifications sent by the table triggers
+_listener = None
+
+# Range changes notified while the tables are being read, replayed over what was
+# read since that may predate them, or None when the tables are not being read
+_pending_range_changes = None
+
+# Task reopening the listener connection after it was lost
+_reconnect_task = None
+_closing = False
+
+
+def _on_flagged_user(conn, pid, channel, payload):
+    """Add a user flagged by any worker to the in-process set"""
+    flagged_users.add(payload)
+
+
+def _on_flagged_ip(conn, pid, channel, payload):
+    """Add an IP flagged by any worker to the in-process set"""
+    flagged_ips.add(str(ipaddress.ip_address(payload)))
+
+
+def _apply_range_change(operation: str, cidr: str):
+    if operation == "INSERT":
+        suspicious_ranges.add(cidr)
+    else:
+        suspicious_ranges.discard(cidr)
+
+
+def _on_ip_range_change(conn, pid, channel, payload):
+    """Apply an IP range added or deleted by any worker to the in-process ranges"""
+    operation, cidr = payload.split(" ", 1)
+    _apply_range_change(operation, cidr)
+    if _pending_range_changes is not None:
+        _pending_range_changes.append((operation, cidr))
+
+
+_CHANNELS = {
+    "flagged_users": _on_flagged_user,
+    "flagged_ips": _on_flagged_ip,
+    "suspicious_ip_ranges": _on_ip_range_change,
+}
+
+
+async def _listen():
+    """Open the listener connection and subscribe to the table notifications"""
+    global _listener
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        for channel, callback in _CHANNELS.items():
+            await conn.add_listener(channel, callback)
+    except BaseException:
+        await conn.close()
+        raise
+    conn.add_termination_listener(_on_listener_terminated)
+    _listener = conn
+
+
+async def _reload():
+    """Read the flagged users and IPs and the suspicious ranges from their tables"""
+    global _pending_range_changes
+    _pending_range_changes = []
+    try:
+        # The tables are read concurrently, each on its own pool connection
+        user_rows, ip_rows, range_rows = await asyncio.gather(
+            _pool.fetch('SELECT "user" FROM flagged_users'),
+            _pool.fetch("SELECT ip FROM flagged_ips"),
+            _pool.fetch("SELECT cidr FROM suspicious_ip_ranges"),
+        )
+
+        flagged_users.update(row["user"] for row in user_rows)
+        # Normalised like the addresses of incoming events, parsed by Pydantic
+        flagged_ips.update(str(ipaddress.ip_address(row["ip"])) for row in ip_rows)
+        # Ranges may have been deleted in the meantime, so they are all replaced.
+        # Changes notified during the read are then applied again, in order: those
+        # the read already saw are no-ops, the later ones would be lost otherwise.
+        suspicious_ranges.replace(row["cidr"] for row in range_rows)
+        for operation, cidr in _pending_range_changes:
+            _apply_range_change(operation, cidr)
+    finally:
+        _pending_range_changes = None
+    logger.info(
+        f"Loaded {len(flagged_users)} flagged users, {len(flagged_ips)} flagged IPs "
+        f"and {len(suspicious_ranges)} suspicious IP ranges"
+    )
+
+
+def _on_listener_terminated(conn):
+    """Start reopening the listener connection when it is lost"""
+    global _reconnect_task
+    if _closing:
+        return
+    logger.warning("Lost the cache notification listener connection, reconnecting")
+    if _reconnect_task is not None:
+        _reconnect_task.cancel()
+    _reconnect_task = asyncio.create_task(_reconnect())
+
+
+async def _reconnect():
+    """Reopen the listener connection, then reload the tables since the
+    notifications sent while it was lost are gone, retrying until both succeed
+    """
+    while True:
+        try:
+            await _listen()
+            break
+        except Exception:
+            logger.exception("Could not reopen the cache notification listener")
+            await asyncio.sleep(RECONNECT_DELAY)
+    while True:
+        try:
+            await _reload()
+            break
+        except Exception:
+            logger.exception("Could not reload the in-process caches")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def load(pool):
+    """Populate the flagged user and IP sets and the suspicious ranges, and
+    subscribe to their updates.
+
+    The subscription is opened before the tables are read, and the range changes
+    notified while they are read are applied over what was read, so that no
+    change made in between is missed. If the subscription connection is lost, it is
+    reopened and the tables are read again.
+
+    Parameters:
+    pool (asyncpg.Pool): The connection pool to read the tables with.
+    """
+    global _pool, _closing
+    _pool = pool
+    _closing = False
+    await _listen()
+    await _reload()
+
+
+async def close():
+    """Close the notification listener connection"""
+    global _closing
+    _closing = True
+    if _reconnect_task is not None:
+        _reconnect_task.cancel()
+    if _listener is not None:
+        await _listener.close()
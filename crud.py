@@ -1,11 +1,43 @@
-from models import suspicious_ip_ranges, events, flagged_users, flagged_ips
-from database import database
-from sqlalchemy import select, exists, func, cast
-from sqlalchemy.dialects.postgresql import INET, CIDR
+from functools import lru_cache
+from typing import List
 
+import asyncio
+import cache
+import database
 import datetime
 
 
+# Kept as constants so that every call sends the exact same text and hits the
+# prepared statement cache of the connection (see statement_cache_size)
+INSERT_EVENT_QUERY = """
+    INSERT INTO events (
+        timestamp, username, source_ip, event_type,
+        file_size_mb, application, success, is_suspicious
+    )
+    VALUES ($1, $2, $3::inet, $4, $5, $6, $7, $8)
+"""
+
+# Flagging an already flagged user or IP is a no-op, so that no prior existence
+# check is needed and concurrent requests flagging the same one do not conflict
+FLAG_USER_QUERY = 'INSERT INTO flagged_users ("user") VALUES ($1) ON CONFLICT DO NOTHING'
+FLAG_IP_QUERY = "INSERT INTO flagged_ips (ip) VALUES ($1::inet) ON CONFLICT DO NOTHING"
+
+# Columns of the suspicious events listing; is_suspicious is always true there
+SUSPICIOUS_EVENT_COLUMNS = (
+    "id, timestamp, username, source_ip, event_type, file_size_mb, application, success"
+)
+
+# Number of suspicious events fetched per round-trip when streaming them
+SUSPICIOUS_EVENTS_PREFETCH = 500
+
+# Maximum time in seconds a suspicious events stream holds its pool connection,
+# so that slow or stalled readers cannot exhaust the pool
+SUSPICIOUS_EVENTS_TIMEOUT = 30
+
+# Marks the end of the events read into a stream queue
+_END_OF_STREAM = object()
+
+
 # CRUD functions for Suspicious IP Ranges
 async def add_ip_range(cidr: str):
     """Add an IP range in CIDR notation to the suspicious IP ranges table.
@@ -16,8 +48,12 @@ async def add_ip_range(cidr: str):
     Returns:
     The result of the database execution.
     """
-    query = suspicious_ip_ranges.insert().values(cidr=cidr)
-    return await database.execute(query)
+    async with database.pool.acquire() as conn:
+        result = await conn.execute(
+            "INSERT INTO suspicious_ip_ranges (cidr) VALUES ($1)", cidr
+        )
+    cache.suspicious_ranges.add(cidr)
+    return result
 
 
 async def get_ip_ranges():
@@ -26,8 +62,8 @@ async def get_ip_ranges():
     Returns:
     A list of all CIDR notations stored in the database.
     """
-    query = select(suspicious_ip_ranges.c.cidr)
-    return await database.fetch_all(query)
+    async with database.pool.acquire() as conn:
+        return await conn.fetch("SELECT cidr FROM suspicious_ip_ranges")
 
 
 async def delete_ip_range(cidr: str):
@@ -39,155 +75,230 @@ async def delete_ip_range(cidr: str):
     Raises:
     ValueError: If the specified IP range is not found in the table.
     """
-    query = suspicious_ip_ranges.delete().where(
-        suspicious_ip_ranges.c.cidr == cast(cidr, CIDR)
-    )
-    rows_affected = await database.execute(query)
+    async with database.pool.acquire() as conn:
+        deleted = await conn.fetchval(
+            "DELETE FROM suspicious_ip_ranges WHERE cidr = $1::cidr RETURNING cidr",
+            cidr,
+        )
 
     # Check if the row was deleted, otherwise raise an error
-    if rows_affected == 0:
+    if deleted is None:
         raise ValueError("IP range not found")
+    cache.suspicious_ranges.discard(deleted)
 
 
-async def is_ip_suspicious(ip: INET) -> bool:
-    """Check if a given IP address falls within any of the suspicious IP ranges.
-
-    Parameters:
-    ip (INET): The IP address to check.
-
-    Returns:
-    bool: True if the IP address is in a suspicious range, False otherwise.
-    """
-    # ip_addr = ipaddress.ip_address(ip)
-    # Use the << operator to check if the IP falls within any range in the `suspicious_ip_ranges` table
-    ip_as_inet = func.cast(ip, INET)
-
-    # Use the << operator via op()
-    condition = ip_as_inet.op("<<")(suspicious_ip_ranges.c.cidr)
-
-    # Build the query
-    query = select(exists().where(condition))
-
-    # Execute the query
-    result = await database.fetch_val(query)
-    return result
-
-
-async def is_user_flagged(user: str) -> bool:
+def is_user_flagged(user: str) -> bool:
     """Check if a user has previously been flagged as suspicious.
 
+    Uses the in-process set of flagged users, so no query is made.
+
     Parameters:
     user (str): The username to check.
 
     Returns:
     bool: True if the user is flagged, False otherwise.
     """
-    query = select(exists().where(flagged_users.c.user == user))
-    result = await database.fetch_val(query)
-    return result
+    return user in cache.flagged_users
 
 
-async def is_ip_flagged(ip: INET) -> bool:
+def is_ip_flagged(ip: str) -> bool:
     """Check if an IP address has previously been flagged as suspicious.
 
+    Uses the in-process set of flagged IPs, so no query is made.
+
     Parameters:
-    ip (INET): The IP address to check.
+    ip (str): The IP address to check.
 
     Returns:
     bool: True if the IP is flagged, False otherwise.
     """
-    query = select(exists().where(flagged_ips.c.ip == ip))
-    result = await database.fetch_val(query)
-    return result
+    return str(ip) in cache.flagged_ips
 
 
-async def process_event(event: dict) -> bool:
-    """Process an event to determine if it is suspicious and store it in the database.
+async def process_events_batch(batch: List[dict]) -> List[bool]:
+    """Process a batch of events in a single transaction.
+
+    Flagged users and IPs are looked up in-process, the IPs of the whole batch
+    are matched against the suspicious ranges in one vectorized operation, and
+    all events are written with a single executemany in one transaction, so the
+    number of round-trips does not grow with the batch size.
+
+    Events are evaluated in order: once an event is found suspicious, its user and
+    IP count as flagged for the remaining events of the batch, just as if they had
+    been processed one by one.
 
     Parameters:
-    event (dict): A dictionary containing event details, including fields like
-                  'username', 'source_ip', 'timestamp', 'event_type', 'file_size_mb',
-                  'application', and 'success'.
+    batch (List[dict]): A list of event dictionaries containing fields like
+                        'username', 'source_ip', 'timestamp', 'event_type',
+                        'file_size_mb', 'application', and 'success'.
 
     Returns:
-    bool: True if the event is flagged as suspicious, False otherwise.
+    List[bool]: The suspicious status of each event, in the order of the batch.
+    """
+    if not batch:
+        return []
+
+    # Match the distinct IPs of the whole batch against the ranges at once
+    ips = list(dict.fromkeys(str(event["source_ip"]) for event in batch))
+    suspicious_ips = {
+        ip
+        for ip, in_range in zip(ips, cache.suspicious_ranges.contains_many(ips))
+        if in_range
+    }
+
+    results = []
+    event_rows = []
+    # Flags raised by this batch, which later events of the batch also see
+    users_to_flag = set()
+    ips_to_flag = set()
+    for event in batch:
+        user = event["username"]
+        ip = str(event["source_ip"])
+        user_is_flagged = is_user_flagged(user) or user in users_to_flag
+        ip_is_flagged = is_ip_flagged(ip) or ip in ips_to_flag
+        is_suspicious = user_is_flagged or ip_is_flagged or ip in suspicious_ips
+
+        if is_suspicious:
+            if not user_is_flagged:
+                users_to_flag.add(user)
+            if not ip_is_flagged:
+                ips_to_flag.add(ip)
+
+        results.append(is_suspicious)
+        event_rows.append(
+            (
+                event["timestamp"],
+                user,
+                ip,
+                event["event_type"],
+                event.get("file_size_mb"),  # Optional field
+                event["application"],
+                event["success"],
+                is_suspicious,
+            )
+        )
+
+    async with database.pool.acquire() as conn, conn.transaction():
+        # Flags are written in sorted order so that concurrent batches flagging the
+        # same users or IPs wait on each other's rows in the same order, rather
+        # than deadlocking
+        await conn.executemany(
+            FLAG_USER_QUERY, [(user,) for user in sorted(users_to_flag)]
+        )
+        await conn.executemany(FLAG_IP_QUERY, [(ip,) for ip in sorted(ips_to_flag)])
+        # A single prepared statement is reused for every row of the batch
+        await conn.executemany(INSERT_EVENT_QUERY, event_rows)
+
+    # Only update the in-process sets once the transaction has committed
+    cache.flagged_users.update(users_to_flag)
+    cache.flagged_ips.update(ips_to_flag)
+    return results
+
+
+@lru_cache(maxsize=None)
+def _suspicious_events_query(by_start_date: bool, by_end_date: bool, by_cursor: bool):
+    """Build the suspicious events query for a combination of filters.
+
+    There are only eight combinations, so each query text is built once and then
+    reused, which also keeps it identical across calls for the statement cache.
+    The arguments are numbered in the order start_date, end_date, before_ts,
+    before_id, limit, skipping the filters that are not applied.
     """
-    user = event["username"]
-    ip = event["source_ip"]
-
-    is_suspicious = False
-    user_is_flagged = await is_user_flagged(user)
-    ip_is_flagged = await is_ip_flagged(ip)
-    ip_is_suspicious = await is_ip_suspicious(ip)
-
-    if ip_is_suspicious or user_is_flagged or ip_is_flagged:
-        is_suspicious = True
-
-        if not user_is_flagged:
-            await flag_user(user)
-
-        if not ip_is_flagged:
-            await flag_ip(ip)
-
-    query = events.insert().values(
-        timestamp=event["timestamp"],  # Convert ISO to datetime
-        username=user,
-        source_ip=ip,
-        event_type=event["event_type"],
-        file_size_mb=event.get("file_size_mb"),  # Optional field
-        application=event["application"],
-        success=event["success"],
-        is_suspicious=is_suspicious,
+    conditions = ["is_suspicious"]
+    position = 0
+
+    # Apply date filters if provided
+    if by_start_date:
+        position += 1
+        conditions.append(f"timestamp >= ${position}")
+    if by_end_date:
+        position += 1
+        conditions.append(f"timestamp <= ${position}")
+
+    # Resume after the last event of the previous page
+    if by_cursor:
+        position += 2
+        conditions.append(f"(timestamp, id) < (${position - 1}, ${position})")
+
+    # Order by the most recent events first
+    return (
+        f"SELECT {SUSPICIOUS_EVENT_COLUMNS} FROM events "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY timestamp DESC, id DESC LIMIT ${position + 1}"
     )
-    await database.execute(query)
-    return is_suspicious
 
 
 async def get_suspicious_events(
     start_date: datetime = None,
     end_date: datetime = None,
     limit: int = 200,
-    offset: int = 0,
+    before_ts: datetime = None,
+    before_id: int = None,
 ):
-    """Retrieve suspicious events with optional date filtering and pagination.
+    """Stream suspicious events with optional date filtering and keyset pagination.
+
+    Events are read from a server-side cursor, SUSPICIOUS_EVENTS_PREFETCH rows at
+    a time, so memory use does not grow with the limit and the first events can be
+    sent while the next ones are being read.
+
+    The cursor is read by a separate task into a bounded queue, which must be done
+    within SUSPICIOUS_EVENTS_TIMEOUT seconds however slowly the events are
+    consumed, so that the pool connection and its transaction are not held for
+    as long as a client takes to read the stream. Past that time the stream
+    raises asyncio.TimeoutError after the events already read.
+
+    Pages are selected by the (timestamp, id) of the last event of the previous
+    page rather than by an offset, so fetching a page costs the same at any depth.
 
     Parameters:
     - start_date (datetime, optional): Filter for events on or after this date.
     - end_date (datetime, optional): Filter for events on or before this date.
     - limit (int, optional): Max number of records to retrieve. Default is 200.
-    - offset (int, optional): Number of records to skip. Default is 0.
+    - before_ts (datetime, optional): Timestamp of the last event of the previous page.
+    - before_id (int, optional): Id of the last event of the previous page.
 
-    Returns:
-    List[Row]: A list of suspicious events, ordered by timestamp in descending order.
+    Yields:
+    dict: The suspicious events, ordered by timestamp then id in descending order.
     """
-    query = events.select().where(events.c.is_suspicious == True)
-
-    # Apply date filters if provided
-    if start_date:
-        query = query.where(events.c.timestamp >= start_date)
-    if end_date:
-        query = query.where(events.c.timestamp <= end_date)
-
-    # Order by the most recent events first
-    query = query.order_by(events.c.timestamp.desc()).limit(limit).offset(offset)
-    return await database.fetch_all(query)
-
-
-async def flag_user(user: str):
-    """Flag a user as suspicious by adding their username to the flagged users table.
-
-    Parameters:
-    user (str): The username of the user to flag.
+    by_cursor = before_ts is not None and before_id is not None
+    query = _suspicious_events_query(
+        start_date is not None, end_date is not None, by_cursor
+    )
+    args = [arg for arg in (start_date, end_date) if arg is not None]
+    if by_cursor:
+        args.extend([before_ts, before_id])
+    args.append(limit)
+
+    queue = asyncio.Queue(maxsize=SUSPICIOUS_EVENTS_PREFETCH)
+    reader = asyncio.ensure_future(_read_suspicious_events(query, args, queue))
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        reader.cancel()
+
+
+async def _read_suspicious_events(query: str, args: list, queue: asyncio.Queue):
+    """Read the events of a suspicious events query into a queue, followed by
+    _END_OF_STREAM, or by the exception raised if reading them failed or took
+    longer than SUSPICIOUS_EVENTS_TIMEOUT seconds
     """
-    query = flagged_users.insert().values(user=user)
-    await database.execute(query)
-
 
-async def flag_ip(ip: INET):
-    """Flag an IP address as suspicious by adding it to the flagged IPs table.
-
-    Parameters:
-    ip (INET): The IP address to flag.
-    """
-    query = flagged_ips.insert().values(ip=ip)
-    await database.execute(query)
+    async def read():
+        # Cursors only exist within a transaction
+        async with database.pool.acquire() as conn, conn.transaction():
+            cursor = conn.cursor(query, *args, prefetch=SUSPICIOUS_EVENTS_PREFETCH)
+            async for row in cursor:
+                await queue.put(dict(row))
+
+    try:
+        await asyncio.wait_for(read(), SUSPICIOUS_EVENTS_TIMEOUT)
+        end = _END_OF_STREAM
+    except Exception as e:
+        end = e
+    await queue.put(end)
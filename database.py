@@ -1,8 +1,13 @@
 from sqlalchemy import create_engine, MetaData
-from databases import Database
+from datetime import datetime, timezone
 
+import asyncio
+import asyncpg
+import logging
 import os
 
+logger = logging.getLogger("FastAPI TestLogger")
+
 # Check environment
 PATH = "/.dockerenv"
 
@@ -20,14 +25,195 @@ engine = create_engine(DATABASE_URL)
 # Create metadata instance to hold table definitions
 metadata = MetaData()
 
-# Set up an async database connection for FastAPI
-database = Database(DATABASE_URL)
+# asyncpg connection pool used by the CRUD functions, created on startup
+pool = None
+
+# Number of monthly events partitions created ahead of the current month, and
+# how often (in seconds) the missing ones are created
+PARTITION_MONTHS_AHEAD = 2
+PARTITION_CHECK_INTERVAL = 24 * 60 * 60
+
+# Background task creating the upcoming events partitions
+_partition_task = None
+
+# Advisory lock held while the startup DDL runs, so that workers starting at the
+# same time apply it one after the other
+STARTUP_DDL_LOCK_ID = 0x70726F70
+
+
+def _create_trigger_if_missing(name: str, table: str, definition: str) -> str:
+    """Return a statement creating a trigger unless it already exists, so that
+    restarts do not take locks on a table to replace its trigger with itself
+    """
+    return f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = '{name}' AND tgrelid = '{table}'::regclass
+        ) THEN
+            CREATE TRIGGER {name} {definition};
+        END IF;
+    END;
+    $$
+    """
+
+
+# DDL applied on startup for what create_all does not handle: indexes added
+# to tables that already exist, and triggers
+STARTUP_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_suspicious_ip_ranges_gist "
+    "ON suspicious_ip_ranges USING gist (cidr inet_ops)",
+    # Superseded by the partial index ix_events_susp_ts_id
+    "DROP INDEX IF EXISTS ix_events_is_suspicious",
+    "CREATE INDEX IF NOT EXISTS ix_events_susp_ts_id "
+    "ON events (timestamp DESC, id DESC) WHERE is_suspicious",
+    # Publish newly flagged users and IPs on a channel named after their table,
+    # so that every worker can keep its in-process sets up to date
+    """
+    CREATE OR REPLACE FUNCTION notify_flagged() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify(TG_TABLE_NAME, to_jsonb(NEW) ->> TG_ARGV[0]);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    _create_trigger_if_missing(
+        "flagged_users_notify",
+        "flagged_users",
+        "AFTER INSERT ON flagged_users "
+        "FOR EACH ROW EXECUTE FUNCTION notify_flagged('user')",
+    ),
+    _create_trigger_if_missing(
+        "flagged_ips_notify",
+        "flagged_ips",
+        "AFTER INSERT ON flagged_ips "
+        "FOR EACH ROW EXECUTE FUNCTION notify_flagged('ip')",
+    ),
+    # Publish added and deleted IP ranges as "<INSERT|DELETE> <cidr>"
+    """
+    CREATE OR REPLACE FUNCTION notify_ip_range() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM pg_notify(TG_TABLE_NAME, TG_OP || ' ' || NEW.cidr);
+        ELSE
+            PERFORM pg_notify(TG_TABLE_NAME, TG_OP || ' ' || OLD.cidr);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    _create_trigger_if_missing(
+        "suspicious_ip_ranges_notify",
+        "suspicious_ip_ranges",
+        "AFTER INSERT OR DELETE ON suspicious_ip_ranges "
+        "FOR EACH ROW EXECUTE FUNCTION notify_ip_range()",
+    ),
+]
+
+
+def _month_start(year: int, month: int) -> datetime:
+    """Return the start of a month in UTC, months past December rolling over"""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+async def create_events_partitions(conn, now: datetime = None):
+    """Create the monthly partitions of the events table, named events_YYYY_MM,
+    for the current month and the PARTITION_MONTHS_AHEAD following ones, along
+    with a default partition holding the events outside of them.
+
+    Existing partitions are left untouched. A partition whose month already has
+    events in the default partition cannot be created, so it is skipped with a
+    warning and those events stay in the default partition.
+
+    Parameters:
+    conn (asyncpg.Connection): The connection to create the partitions with.
+    now (datetime, optional): The date of the current month. Defaults to now.
+    """
+    relkind = await conn.fetchval(
+        "SELECT relkind::text FROM pg_class WHERE oid = 'events'::regclass"
+    )
+    if relkind != "p":
+        # Tables created before partitioning cannot be converted in place
+        logger.warning("The events table is not partitioned, recreate it to do so")
+        return
+
+    await conn.execute(
+        "CREATE TABLE IF NOT EXISTS events_default PARTITION OF events DEFAULT"
+    )
+    for name, start, end in _events_partitions(now or datetime.now(timezone.utc)):
+        try:
+            await conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF events "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        except asyncpg.PostgresError as e:
+            logger.warning(f"Could not create the {start:%Y-%m} events partition: {e}")
+
+
+def _events_partitions(now: datetime):
+    """Return the name, start and end of the events partitions of the month of
+    `now` and the PARTITION_MONTHS_AHEAD following ones
+    """
+    partitions = []
+    for offset in range(PARTITION_MONTHS_AHEAD + 1):
+        start = _month_start(now.year, now.month + offset)
+        end = _month_start(now.year, now.month + offset + 1)
+        partitions.append((f"events_{start:%Y_%m}", start, end))
+    return partitions
+
+
+async def _maintain_events_partitions():
+    """Periodically create the upcoming events partitions"""
+    while True:
+        await asyncio.sleep(PARTITION_CHECK_INTERVAL)
+        # A failed attempt must not end the task, or the partitions would stop
+        # being created; the next one is made after the next interval
+        try:
+            async with pool.acquire() as conn:
+                await create_events_partitions(conn)
+        except Exception:
+            logger.exception("Could not create the upcoming events partitions")
+
+
+async def _init_connection(conn):
+    """Decode inet and cidr values as their canonical text rather than as
+    ipaddress objects, which are slow to build and only ever turned back into text.
+    The codecs are registered once per pooled connection, when it is opened.
+    """
+    for type_name in ("inet", "cidr"):
+        await conn.set_type_codec(
+            type_name, encoder=str, decoder=str, schema="pg_catalog", format="text"
+        )
 
 
 # Functions to connect and disconnect from the database
 async def connect_db():
-    await database.connect()
+    global pool
+    pool = await asyncpg.create_pool(
+        dsn=DATABASE_URL,
+        init=_init_connection,
+        min_size=10,
+        max_size=50,
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=1024,  # Hot queries stay prepared on each connection
+    )
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # Concurrent DDL on the same objects fails, e.g. CREATE OR REPLACE
+            # FUNCTION with "tuple concurrently updated"
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", STARTUP_DDL_LOCK_ID)
+            for statement in STARTUP_DDL:
+                await conn.execute(statement)
+        await create_events_partitions(conn)
+
+    global _partition_task
+    _partition_task = asyncio.create_task(_maintain_events_partitions())
+    return pool
 
 
 async def disconnect_db():
-    await database.disconnect()
+    if _partition_task is not None:
+        _partition_task.cancel()
+    await pool.close()
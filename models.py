@@ -8,15 +8,28 @@ suspicious_ip_ranges = Table(
     "suspicious_ip_ranges",
     metadata,
     Column("cidr", CIDR, primary_key=True, nullable=False),
+    # GiST index so that the << containment lookups can use an index scan
+    Index(
+        "ix_suspicious_ip_ranges_gist",
+        "cidr",
+        postgresql_using="gist",
+        postgresql_ops={"cidr": "inet_ops"},
+    ),
 )
 
-# Events table
+# Events table, partitioned by month of timestamp so that date-filtered queries
+# only scan the matching partitions (see database.create_events_partitions).
+# The partition key must be part of the primary key.
 events = Table(
     "events",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column(
-        "timestamp", DateTime(timezone=True), nullable=False, default=func.now()
+        "timestamp",
+        DateTime(timezone=True),
+        primary_key=True,
+        nullable=False,
+        default=func.now(),
     ),  # Timestamp of the event
     Column("username", String, nullable=False),
     Column("source_ip", INET, nullable=False),
@@ -33,7 +46,17 @@ events = Table(
     Column(
         "is_suspicious", Boolean, nullable=False, default=False
     ),
-    Index("ix_events_is_suspicious", "is_suspicious"),   # Indexed on is_supicious to speed up queries
+    postgresql_partition_by="RANGE (timestamp)",
+)
+
+# Partial index serving the suspicious events listing (WHERE is_suspicious
+# ORDER BY timestamp DESC, id DESC) as an index range scan, without a sort step.
+# Being defined on the partitioned table, it is created on every partition.
+Index(
+    "ix_events_susp_ts_id",
+    events.c.timestamp.desc(),
+    events.c.id.desc(),
+    postgresql_where=events.c.is_suspicious,
 )
 
 # Tables for flagged users and flagged IPs
@@ -0,0 +1,218 @@
+from collections import OrderedDict
+
+import ipaddress
+import socket
+
+import numpy as np
+
+_LOW_64_BITS = (1 << 64) - 1
+
+# Upper bound on the size of the (addresses x ranges) match matrix built at once
+_MAX_MATCH_CELLS = 1 << 20
+
+
+def parse_ip(ip: str):
+    """Parse an IP address into its version and integer value.
+
+    inet_pton parses in C, which is much faster than ipaddress.ip_address.
+
+    Parameters:
+    ip (str): The IPv4 or IPv6 address to parse.
+
+    Returns:
+    tuple: The IP version (4 or 6) and the address as an integer.
+
+    Raises:
+    OSError: If the address is not a valid IPv4 or IPv6 address.
+    """
+    if ":" in ip:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+    return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+
+
+def _split_v6(values):
+    """Split 128-bit integers into arrays of their high and low 64 bits"""
+    high = np.array([value >> 64 for value in values], dtype=np.uint64)
+    low = np.array([value & _LOW_64_BITS for value in values], dtype=np.uint64)
+    return high, low
+
+
+def _match(lanes):
+    """Match addresses against ranges by broadcasting them into a matrix.
+
+    Parameters:
+    lanes (list): (addresses, masks, networks) array triples, one per machine
+                  word of the addresses: a single one for IPv4, the high and the
+                  low halves for IPv6. A range matches when every lane matches.
+
+    Returns:
+    np.ndarray: A boolean array, True where the address is in any range.
+    """
+    count = len(lanes[0][0])
+    range_count = len(lanes[0][1])
+    chunk = max(1, _MAX_MATCH_CELLS // range_count)
+
+    result = np.empty(count, dtype=bool)
+    for start in range(0, count, chunk):
+        stop = min(start + chunk, count)
+        matches = np.ones((stop - start, range_count), dtype=bool)
+        for values, masks, networks in lanes:
+            matches &= (values[start:stop, None] & masks) == networks
+        result[start:stop] = matches.any(axis=1)
+    return result
+
+
+class RangeSet:
+    """A set of IP ranges that can tell whether an address falls within any of them.
+
+    The ranges are laid out as a structure of arrays: the network addresses and
+    the netmasks of each IP version are held in parallel NumPy arrays, so that an
+    address is matched against all ranges at once with a vectorized
+    `(ip & masks) == networks`. IPv6 values do not fit a NumPy integer, so each
+    IPv6 array is split into a high and a low uint64 half.
+
+    The arrays are rebuilt when ranges are added or removed, which is rare
+    compared to lookups.
+
+    The results of the most recent lookups are kept in an LRU cache, as attacks
+    tend to come in bursts from a small set of addresses. The cache is cleared
+    whenever the ranges change.
+    """
+
+    def __init__(self, cidrs=(), lookup_cache_size: int = 65536):
+        self._ranges = {ipaddress.ip_network(cidr) for cidr in cidrs}
+        self._lookup_cache_size = lookup_cache_size
+        self._lookups = OrderedDict()
+        self._rebuild()
+
+    def __len__(self):
+        return len(self._ranges)
+
+    def __iter__(self):
+        return (str(network) for network in self._ranges)
+
+    def __contains__(self, ip: str) -> bool:
+        in_range = self._cached_lookup(ip)
+        if in_range is None:
+            in_range = self._match_one(ip)
+            self._remember(ip, in_range)
+        return in_range
+
+    def contains_many(self, ips):
+        """Check a batch of addresses against all ranges.
+
+        Addresses missing from the lookup cache are matched together in
+        vectorized operations.
+
+        Parameters:
+        ips (List[str]): The IP addresses to check.
+
+        Returns:
+        np.ndarray: A boolean array, True where the address is in any range.
+        """
+        result = np.empty(len(ips), dtype=bool)
+        misses = []
+        for position, ip in enumerate(ips):
+            in_range = self._cached_lookup(ip)
+            if in_range is None:
+                misses.append(position)
+            else:
+                result[position] = in_range
+
+        if misses:
+            matches = self._match_many([ips[position] for position in misses])
+            result[misses] = matches
+            for position, in_range in zip(misses, matches):
+                self._remember(ips[position], bool(in_range))
+        return result
+
+    def _cached_lookup(self, ip: str):
+        """Return the cached result of a lookup, or None if it is not cached"""
+        in_range = self._lookups.get(ip)
+        if in_range is not None:
+            self._lookups.move_to_end(ip)
+        return in_range
+
+    def _remember(self, ip: str, in_range: bool):
+        """Cache the result of a lookup, evicting the least recently used one if full"""
+        self._lookups[ip] = in_range
+        if len(self._lookups) > self._lookup_cache_size:
+            self._lookups.popitem(last=False)
+
+    def _match_one(self, ip: str) -> bool:
+        version, value = parse_ip(ip)
+        if version == 4:
+            matches = (np.uint32(value) & self._masks_v4) == self._networks_v4
+        else:
+            high = np.uint64(value >> 64)
+            low = np.uint64(value & _LOW_64_BITS)
+            matches = ((high & self._masks_v6_high) == self._networks_v6_high) & (
+                (low & self._masks_v6_low) == self._networks_v6_low
+            )
+        return bool(matches.any())
+
+    def _match_many(self, ips):
+        """Match a batch of addresses against all ranges in vectorized operations.
+
+        Each IP version is matched as an (addresses x ranges) matrix built by
+        broadcasting, in chunks bounding the size of that matrix.
+        """
+        parsed = [parse_ip(ip) for ip in ips]
+        result = np.zeros(len(parsed), dtype=bool)
+
+        v4_positions = [i for i, (version, _) in enumerate(parsed) if version == 4]
+        v6_positions = [i for i, (version, _) in enumerate(parsed) if version == 6]
+
+        if v4_positions and len(self._networks_v4):
+            values = np.array([parsed[i][1] for i in v4_positions], dtype=np.uint32)
+            result[v4_positions] = _match(
+                [(values, self._masks_v4, self._networks_v4)]
+            )
+        if v6_positions and len(self._networks_v6_high):
+            high, low = _split_v6([parsed[i][1] for i in v6_positions])
+            result[v6_positions] = _match(
+                [
+                    (high, self._masks_v6_high, self._networks_v6_high),
+                    (low, self._masks_v6_low, self._networks_v6_low),
+                ]
+            )
+        return result
+
+    def add(self, cidr: str):
+        """Add an IP range in CIDR notation"""
+        self._ranges.add(ipaddress.ip_network(cidr))
+        self._rebuild()
+
+    def update(self, cidrs):
+        """Add several IP ranges in CIDR notation, rebuilding the arrays only once"""
+        self._ranges.update(ipaddress.ip_network(cidr) for cidr in cidrs)
+        self._rebuild()
+
+    def replace(self, cidrs):
+        """Replace all IP ranges with the given ones in CIDR notation"""
+        self._ranges = {ipaddress.ip_network(cidr) for cidr in cidrs}
+        self._rebuild()
+
+    def discard(self, cidr: str):
+        """Remove an IP range in CIDR notation, if present"""
+        self._ranges.discard(ipaddress.ip_network(cidr))
+        self._rebuild()
+
+    def _rebuild(self):
+        self._lookups.clear()
+
+        v4 = [network for network in self._ranges if network.version == 4]
+        v6 = [network for network in self._ranges if network.version == 6]
+
+        self._networks_v4 = np.array(
+            [int(network.network_address) for network in v4], dtype=np.uint32
+        )
+        self._masks_v4 = np.array(
+            [int(network.netmask) for network in v4], dtype=np.uint32
+        )
+        self._networks_v6_high, self._networks_v6_low = _split_v6(
+            [int(network.network_address) for network in v6]
+        )
+        self._masks_v6_high, self._masks_v6_low = _split_v6(
+            [int(network.netmask) for network in v6]
+        )
@@ -1,7 +1,8 @@
 from asyncpg.exceptions import UniqueViolationError
 import ipaddress
+import orjson
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from httpx import AsyncClient
 from app import app
 from datetime import datetime
@@ -32,6 +33,12 @@ sample_invalid_event = {
     "success": True,
 }
 
+
+async def stream(rows):
+    for row in rows:
+        yield row
+
+
 # Mock functions
 @pytest.fixture(autouse=True)
 def mock_database_operations():
@@ -42,15 +49,16 @@ def mock_database_operations():
     ) as mock_get_ip_ranges, patch(
         "crud.delete_ip_range", new=AsyncMock(return_value=None)
     ) as mock_delete_ip_range, patch(
-        "crud.process_event", new=AsyncMock(return_value=True)
-    ) as mock_process_event, patch(
-        "crud.get_suspicious_events", new=AsyncMock(return_value=sample_events)
+        "crud.process_events_batch", new=AsyncMock(return_value=[True])
+    ) as mock_process_events_batch, patch(
+        "crud.get_suspicious_events",
+        new=MagicMock(side_effect=lambda **kwargs: stream(sample_events)),
     ) as mock_get_suspicious_events:
         yield {
             "mock_add_ip_range": mock_add_ip_range,
             "mock_get_ip_ranges": mock_get_ip_ranges,
             "mock_delete_ip_range": mock_delete_ip_range,
-            "mock_process_event": mock_process_event,
+            "mock_process_events_batch": mock_process_events_batch,
             "mock_get_suspicious_events": mock_get_suspicious_events,
         }
 
@@ -78,7 +86,9 @@ async def test_add_ip_range(test_client, mock_database_operations):
 async def test_add_invalid_ip_range(test_client):
     response = await test_client.post("/ip-ranges", json=sample_invalid_ip_range)
     assert response.status_code == 422
-    assert "does not appear to be an IPv4 or IPv6 network" in response.json()["detail"]
+    validation_error = response.json()["detail"][0]
+    assert validation_error["loc"] == ["body", "cidr"]
+    assert validation_error["type"] == "ip_any_network"
 
 
 @pytest.mark.asyncio
@@ -119,6 +129,17 @@ async def test_delete_ip_range(test_client, mock_database_operations):
     )
 
 
+# Test case for deleting an invalid IP range
+@pytest.mark.asyncio
+async def test_delete_invalid_ip_range(test_client, mock_database_operations):
+    response = await test_client.delete("/ip-ranges", params=sample_invalid_ip_range)
+    assert response.status_code == 422
+    validation_error = response.json()["detail"][0]
+    assert validation_error["loc"] == ["query", "cidr"]
+    assert validation_error["type"] == "ip_any_network"
+    mock_database_operations["mock_delete_ip_range"].assert_not_called()
+
+
 # Test case for deleting a non-existent IP range
 @pytest.mark.asyncio
 async def test_delete_nonexistent_ip_range(test_client, mock_database_operations):
@@ -152,14 +173,15 @@ async def test_process_event(test_client, mock_database_operations):
     assert len(results) == len(sample_events)
     assert results[0]["is_suspicious"] is True
 
-    actual_call_args = mock_database_operations["mock_process_event"].call_args[0][0]
+    actual_call_args = mock_database_operations["mock_process_events_batch"].call_args[0][0]
 
     # Convert `source_ip` to string if it's an IPv4Address
-    if isinstance(actual_call_args["source_ip"], ipaddress.IPv4Address):
-        actual_call_args["source_ip"] = str(actual_call_args["source_ip"])
-    expected_event = sample_event.copy()
-    expected_event["source_ip"] = str(expected_event["source_ip"])
-    mock_database_operations["mock_process_event"].assert_called_once_with(sample_event)
+    for actual_event in actual_call_args:
+        if isinstance(actual_event["source_ip"], ipaddress.IPv4Address):
+            actual_event["source_ip"] = str(actual_event["source_ip"])
+    mock_database_operations["mock_process_events_batch"].assert_called_once_with(
+        sample_events
+    )
 
 
 # Test case for processing a invalid suspicious event
@@ -178,7 +200,7 @@ async def test_process_event_value_error(test_client, mock_database_operations):
         for event in sample_events
     ]
 
-    mock_database_operations["mock_process_event"].side_effect = ValueError(
+    mock_database_operations["mock_process_events_batch"].side_effect = ValueError(
         "Invalid IP address format"
     )
 
@@ -197,11 +219,66 @@ async def test_process_event_value_error(test_client, mock_database_operations):
 async def test_get_suspicious_events(test_client, mock_database_operations):
     response = await test_client.get("/suspicious-events")
     assert response.status_code == 200
-    events = response.json()
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [orjson.loads(line) for line in response.text.splitlines()]
     assert len(events) == len(sample_events)
+    assert events[0]["username"] == sample_event["username"]
     mock_database_operations["mock_get_suspicious_events"].assert_called_once()
 
 
+# Test case for fetching the events following the last one received
+@pytest.mark.asyncio
+async def test_get_suspicious_events_next_page(test_client, mock_database_operations):
+    mock_database_operations["mock_get_suspicious_events"].side_effect = (
+        lambda **kwargs: stream([{**sample_event, "id": 42}])
+    )
+    response = await test_client.get("/suspicious-events", params={"limit": 1})
+    assert response.status_code == 200
+    last_event = orjson.loads(response.text.splitlines()[-1])
+    assert last_event["id"] == 42
+
+    response = await test_client.get(
+        "/suspicious-events",
+        params={
+            "limit": 1,
+            "before_ts": last_event["timestamp"],
+            "before_id": last_event["id"],
+        },
+    )
+    assert response.status_code == 200
+    call_kwargs = mock_database_operations["mock_get_suspicious_events"].call_args.kwargs
+    assert call_kwargs["before_id"] == 42
+    assert call_kwargs["before_ts"] == sample_event["timestamp"]
+
+
+# Test case for a cursor missing one of its parts
+@pytest.mark.asyncio
+async def test_get_suspicious_events_partial_cursor(test_client):
+    response = await test_client.get("/suspicious-events", params={"before_id": 42})
+    assert response.status_code == 422
+    assert response.json() == {
+        "detail": "before_ts and before_id must be given together"
+    }
+
+
+# Test case for an event from a zone-scoped IPv6 address
+@pytest.mark.asyncio
+async def test_process_event_scoped_ipv6(test_client, mock_database_operations):
+    request_data = [
+        {
+            **sample_event,
+            "timestamp": sample_event["timestamp"].isoformat(),
+            "source_ip": "fe80::1%eth0",
+        }
+    ]
+    response = await test_client.post("/process-event", json=request_data)
+    assert response.status_code == 200
+    assert response.json()[0]["ip"] == "fe80::1"
+
+    actual_call_args = mock_database_operations["mock_process_events_batch"].call_args
+    assert str(actual_call_args[0][0][0]["source_ip"]) == "fe80::1"
+
+
 # Test case for invalid event data (e.g., invalid IP address)
 @pytest.mark.asyncio
 async def test_invalid_event_data(test_client):
@@ -0,0 +1,56 @@
+from ranges import RangeSet
+
+import cache
+import pytest
+
+
+class FakePool:
+    """Pool returning table snapshots, with range changes notified while the
+    suspicious ranges are being read
+    """
+
+    def __init__(self, range_rows, notifications):
+        self.range_rows = range_rows
+        self.notifications = notifications
+
+    async def fetch(self, query):
+        if "suspicious_ip_ranges" not in query:
+            return []
+        for payload in self.notifications:
+            cache._on_ip_range_change(None, 0, "suspicious_ip_ranges", payload)
+        return self.range_rows
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(cache, "flagged_users", set())
+    monkeypatch.setattr(cache, "flagged_ips", set())
+    monkeypatch.setattr(cache, "suspicious_ranges", RangeSet())
+
+
+# Test case for range changes notified while the ranges are being read
+@pytest.mark.asyncio
+async def test_reload_keeps_changes_notified_during_read(monkeypatch):
+    pool = FakePool(
+        # Read before the changes below were made
+        range_rows=[{"cidr": "192.168.0.0/16"}],
+        notifications=["INSERT 172.16.0.0/12", "DELETE 192.168.0.0/16"],
+    )
+    monkeypatch.setattr(cache, "_pool", pool)
+
+    await cache._reload()
+    assert list(cache.suspicious_ranges) == ["172.16.0.0/12"]
+    assert cache._pending_range_changes is None
+
+
+# Test case for notified changes the read already includes
+@pytest.mark.asyncio
+async def test_reload_with_changes_already_read(monkeypatch):
+    pool = FakePool(
+        range_rows=[{"cidr": "10.0.0.0/8"}, {"cidr": "172.16.0.0/12"}],
+        notifications=["INSERT 172.16.0.0/12", "DELETE 192.168.0.0/16"],
+    )
+    monkeypatch.setattr(cache, "_pool", pool)
+
+    await cache._reload()
+    assert sorted(cache.suspicious_ranges) == ["10.0.0.0/8", "172.16.0.0/12"]
@@ -0,0 +1,171 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+from ranges import RangeSet
+
+import asyncio
+import itertools
+import cache
+import crud
+import database
+import pytest
+import re
+
+
+class FakeConnection:
+    """Connection recording the statements executed in its transaction"""
+
+    def __init__(self):
+        self.executed = []
+        self.committed = False
+        self.rows = []
+        self.cursors = []
+
+    async def executemany(self, query, rows):
+        assert not self.committed
+        self.executed.append((query, list(rows)))
+
+    async def cursor(self, query, *args, prefetch):
+        self.cursors.append((query, args))
+        for row in self.rows:
+            yield row
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+        # The in-process sets must only change once the transaction has committed
+        assert cache.flagged_users == {"dave"}
+        assert cache.flagged_ips == set()
+        self.committed = True
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.acquired = False
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.acquired = True
+        try:
+            yield self.conn
+        finally:
+            self.acquired = False
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(database, "pool", pool)
+    monkeypatch.setattr(cache, "flagged_users", {"dave"})
+    monkeypatch.setattr(cache, "flagged_ips", set())
+    monkeypatch.setattr(cache, "suspicious_ranges", RangeSet(["10.0.0.0/8"]))
+    return pool
+
+
+def make_event(username, source_ip):
+    return {
+        "timestamp": datetime(2024, 1, 1),
+        "username": username,
+        "source_ip": source_ip,
+        "event_type": "login",
+        "file_size_mb": None,
+        "application": "email",
+        "success": True,
+    }
+
+
+# Test case for flags raised by an event applying to the later events of its batch
+@pytest.mark.asyncio
+async def test_process_events_batch(fake_pool):
+    batch = [
+        make_event("alice", "10.0.0.1"),  # In a suspicious range
+        make_event("alice", "1.1.1.1"),  # User flagged by the first event
+        make_event("bob", "1.1.1.1"),  # IP flagged by the second event
+        make_event("carol", "2.2.2.2"),
+        make_event("dave", "3.3.3.3"),  # User flagged before the batch
+    ]
+    results = await crud.process_events_batch(batch)
+    assert results == [True, True, True, False, True]
+
+    conn = fake_pool.conn
+    assert conn.committed
+    flag_users, flag_ips, insert_events = conn.executed
+    # Only new flags are written, in sorted order
+    assert flag_users == (crud.FLAG_USER_QUERY, [("alice",), ("bob",)])
+    assert flag_ips == (
+        crud.FLAG_IP_QUERY,
+        [("1.1.1.1",), ("10.0.0.1",), ("3.3.3.3",)],
+    )
+    assert insert_events[0] == crud.INSERT_EVENT_QUERY
+    assert [row[7] for row in insert_events[1]] == results
+
+    assert cache.flagged_users == {"alice", "bob", "dave"}
+    assert cache.flagged_ips == {"1.1.1.1", "10.0.0.1", "3.3.3.3"}
+
+
+# Test case for an empty batch, which makes no query
+@pytest.mark.asyncio
+async def test_process_empty_events_batch(fake_pool):
+    assert await crud.process_events_batch([]) == []
+    assert fake_pool.conn.executed == []
+
+
+# Test case for streaming suspicious events
+@pytest.mark.asyncio
+async def test_get_suspicious_events(fake_pool):
+    fake_pool.conn.rows = [{"id": 2}, {"id": 1}]
+    events = [event async for event in crud.get_suspicious_events(limit=2)]
+    assert events == [{"id": 2}, {"id": 1}]
+    assert not fake_pool.acquired
+
+
+# Test case for a stream read too slowly, which must release its connection
+@pytest.mark.asyncio
+async def test_get_suspicious_events_timeout(fake_pool, monkeypatch):
+    monkeypatch.setattr(crud, "SUSPICIOUS_EVENTS_PREFETCH", 1)
+    monkeypatch.setattr(crud, "SUSPICIOUS_EVENTS_TIMEOUT", 0.05)
+    fake_pool.conn.rows = [{"id": 3}, {"id": 2}, {"id": 1}]
+
+    events = crud.get_suspicious_events(limit=3)
+    assert await events.__anext__() == {"id": 3}
+    # The reader gives up while the stream is not being read
+    await asyncio.sleep(0.1)
+    assert not fake_pool.acquired
+    with pytest.raises(asyncio.TimeoutError):
+        async for event in events:
+            pass
+
+
+# Test case for the query placeholders of every combination of filters
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "by_start_date, by_end_date, by_cursor",
+    list(itertools.product([False, True], repeat=3)),
+)
+async def test_get_suspicious_events_placeholders(
+    fake_pool, by_start_date, by_end_date, by_cursor
+):
+    filters = {"limit": 10}
+    if by_start_date:
+        filters["start_date"] = datetime(2024, 1, 1)
+    if by_end_date:
+        filters["end_date"] = datetime(2024, 2, 1)
+    if by_cursor:
+        filters["before_ts"] = datetime(2024, 1, 15)
+        filters["before_id"] = 42
+    [event async for event in crud.get_suspicious_events(**filters)]
+
+    (query, args), = fake_pool.conn.cursors
+    placeholders = sorted(int(n) for n in re.findall(r"\$(\d+)", query))
+    assert placeholders == list(range(1, len(args) + 1))
+    assert sorted(args, key=repr) == sorted(filters.values(), key=repr)
+    # Each value is bound to the placeholder of its own condition
+    position = {name: args.index(value) + 1 for name, value in filters.items()}
+    if by_start_date:
+        assert f"timestamp >= ${position['start_date']}" in query
+    if by_end_date:
+        assert f"timestamp <= ${position['end_date']}" in query
+    if by_cursor:
+        before_ts, before_id = position["before_ts"], position["before_id"]
+        assert f"(timestamp, id) < (${before_ts}, ${before_id})" in query
+    assert query.endswith(f"LIMIT ${position['limit']}")
@@ -0,0 +1,63 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import asyncio
+import database
+import pytest
+
+
+def test_month_start():
+    assert database._month_start(2024, 1) == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert database._month_start(2024, 12) == datetime(2024, 12, 1, tzinfo=timezone.utc)
+    # Months past December roll over to the following years
+    assert database._month_start(2024, 13) == datetime(2025, 1, 1, tzinfo=timezone.utc)
+    assert database._month_start(2024, 26) == datetime(2026, 2, 1, tzinfo=timezone.utc)
+
+
+def test_events_partitions(monkeypatch):
+    monkeypatch.setattr(database, "PARTITION_MONTHS_AHEAD", 2)
+    now = datetime(2024, 11, 15, 13, 30, tzinfo=timezone.utc)
+    assert database._events_partitions(now) == [
+        (
+            "events_2024_11",
+            datetime(2024, 11, 1, tzinfo=timezone.utc),
+            datetime(2024, 12, 1, tzinfo=timezone.utc),
+        ),
+        (
+            "events_2024_12",
+            datetime(2024, 12, 1, tzinfo=timezone.utc),
+            datetime(2025, 1, 1, tzinfo=timezone.utc),
+        ),
+        (
+            "events_2025_01",
+            datetime(2025, 1, 1, tzinfo=timezone.utc),
+            datetime(2025, 2, 1, tzinfo=timezone.utc),
+        ),
+    ]
+
+
+# Test case for the partition task surviving a failed attempt
+@pytest.mark.asyncio
+async def test_maintain_events_partitions_after_failure(monkeypatch):
+    attempts = []
+
+    class FlakyPool:
+        @asynccontextmanager
+        async def acquire(self):
+            attempts.append(None)
+            if len(attempts) == 1:
+                raise ConnectionError("connection lost")
+            yield None
+
+    async def create_events_partitions(conn):
+        created.set()
+
+    created = asyncio.Event()
+    monkeypatch.setattr(database, "pool", FlakyPool())
+    monkeypatch.setattr(database, "PARTITION_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(database, "create_events_partitions", create_events_partitions)
+
+    task = asyncio.create_task(database._maintain_events_partitions())
+    await asyncio.wait_for(created.wait(), timeout=1)
+    assert not task.done()
+    task.cancel()
@@ -0,0 +1,113 @@
+import pytest
+from ranges import RangeSet, parse_ip
+
+
+def test_parse_ip():
+    assert parse_ip("10.0.0.1") == (4, 0x0A000001)
+    assert parse_ip("2001:db8::1") == (6, 0x20010DB8 << 96 | 1)
+
+
+def test_parse_invalid_ip():
+    with pytest.raises(OSError):
+        parse_ip("invalid_ip")
+
+
+def test_empty_range_set():
+    ranges = RangeSet()
+    assert len(ranges) == 0
+    assert "10.0.0.1" not in ranges
+    assert "2001:db8::1" not in ranges
+
+
+def test_ipv4_ranges():
+    ranges = RangeSet(["10.0.0.0/8", "173.99.253.0/24", "192.0.2.7/32"])
+    assert "10.255.0.1" in ranges
+    assert "173.99.253.17" in ranges
+    assert "192.0.2.7" in ranges
+    assert "173.99.254.17" not in ranges
+    assert "192.0.2.8" not in ranges
+    assert "11.0.0.1" not in ranges
+
+
+def test_ipv6_ranges():
+    # The /72 prefix spans the high and low 64-bit halves
+    ranges = RangeSet(["2001:db8::/32", "2001:db9:0:0:ab00::/72"])
+    assert "2001:db8:ffff::1" in ranges
+    assert "2001:db9::abcd:0:0:1" in ranges
+    assert "2001:db9::ac00:0:0:1" not in ranges
+    assert "2001:dba::1" not in ranges
+    # IPv6 ranges never match IPv4 addresses and vice versa
+    assert "32.1.13.184" not in ranges
+
+
+def test_catch_all_ranges():
+    ranges = RangeSet(["0.0.0.0/0"])
+    assert "203.0.113.9" in ranges
+    assert "::1" not in ranges
+    ranges.add("::/0")
+    assert "::1" in ranges
+
+
+def test_add_and_discard():
+    ranges = RangeSet()
+    ranges.add("10.0.0.0/8")
+    ranges.update(["192.168.0.0/16", "2001:db8::/32"])
+    assert sorted(ranges) == ["10.0.0.0/8", "192.168.0.0/16", "2001:db8::/32"]
+    assert "192.168.1.1" in ranges
+
+    ranges.discard("192.168.0.0/16")
+    ranges.discard("172.16.0.0/12")  # Not present
+    assert len(ranges) == 2
+    assert "192.168.1.1" not in ranges
+    assert "10.1.1.1" in ranges
+
+
+def test_contains_many():
+    ranges = RangeSet(["10.0.0.0/8", "2001:db8::/32", "2001:db9:0:0:ab00::/72"])
+    ips = ["10.1.1.1", "2001:db8::1", "11.1.1.1", "2001:db9::abcd:0:0:1", "::1"]
+    assert ranges.contains_many(ips).tolist() == [True, True, False, True, False]
+    assert ranges.contains_many(ips).tolist() == [ip in ranges for ip in ips]
+
+
+def test_contains_many_without_matching_version():
+    ranges = RangeSet(["10.0.0.0/8"])
+    assert ranges.contains_many(["10.1.1.1", "2001:db8::1"]).tolist() == [True, False]
+    assert ranges.contains_many([]).tolist() == []
+    assert RangeSet().contains_many(["10.1.1.1"]).tolist() == [False]
+
+
+def test_contains_many_in_chunks(monkeypatch):
+    monkeypatch.setattr("ranges._MAX_MATCH_CELLS", 4)
+    ranges = RangeSet(["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"])
+    ips = ["10.0.0.1", "8.8.8.8", "172.16.5.4", "192.168.1.1", "1.1.1.1"]
+    assert ranges.contains_many(ips).tolist() == [True, False, True, True, False]
+
+
+def test_lookup_cache_is_cleared_on_changes():
+    ranges = RangeSet()
+    assert "10.1.1.1" not in ranges
+    assert ranges.contains_many(["10.2.2.2"]).tolist() == [False]
+
+    ranges.add("10.0.0.0/8")
+    assert "10.1.1.1" in ranges
+    assert ranges.contains_many(["10.2.2.2"]).tolist() == [True]
+
+    ranges.discard("10.0.0.0/8")
+    assert "10.1.1.1" not in ranges
+    assert ranges.contains_many(["10.2.2.2"]).tolist() == [False]
+
+
+def test_lookup_cache_is_bounded():
+    ranges = RangeSet(["10.0.0.0/8"], lookup_cache_size=2)
+    ranges.contains_many(["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+    assert "10.0.0.3" in ranges
+    assert len(ranges._lookups) == 2
+
+
+def test_replace():
+    ranges = RangeSet(["10.0.0.0/8", "192.168.0.0/16"])
+    assert "10.1.1.1" in ranges
+    ranges.replace(["192.168.0.0/16", "2001:db8::/32"])
+    assert sorted(ranges) == ["192.168.0.0/16", "2001:db8::/32"]
+    assert "10.1.1.1" not in ranges
+    assert "2001:db8::1" in ranges